@@ -37,13 +37,17 @@ if question := st.chat_input("Ask me about anything...but actually...anything...
                 st.title(f"""Prompts used sorted by semantic similarity:""")
                 # writing the specific prompts that were selected based on the question
                 st.markdown(answer[1])
-            # writing the answer to the front end
-            message_placeholder.markdown(f"{answer[0]}")
+            # writing the answer to the front end as it is streamed back from Amazon Bedrock
+            full_answer = ""
+            for chunk in answer[0]:
+                # adding the newest part of the answer and re-rendering the full answer generated so far
+                full_answer += chunk
+                message_placeholder.markdown(full_answer)
             # showing a completion message to the front end
             status.update(label="Question Answered...", state="complete", expanded=False)
     # appending the results to the session state
     st.session_state.messages.append({"role": "assistant",
-                                      "content": answer})
+                                      "content": full_answer})
     # invoking that chat_history function in the chat_history_prompt_generator.py file to format past questions and
     # answers and dynamically add them to future prompt
     chat_history(st.session_state)
\ No newline at end of file
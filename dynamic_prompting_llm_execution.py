@@ -1,29 +1,83 @@
 import os
+import re
+import asyncio
+import functools
+import hashlib
+import mmap
+import tempfile
+import threading
+import zipfile
+from collections import OrderedDict
 from dotenv import load_dotenv
 import boto3
-import json
+import orjson
 import botocore.config
+import faiss
+import numpy as np
 import yaml
-from langchain.prompts.few_shot import FewShotPromptTemplate
+from fastembed import TextEmbedding
+from langchain.docstore.in_memory import InMemoryDocstore
 from langchain.prompts.prompt import PromptTemplate
-from langchain.embeddings.huggingface import HuggingFaceEmbeddings
+from langchain.schema import Document
+from langchain.schema.embeddings import Embeddings
 from langchain.prompts.example_selector.semantic_similarity import (
     SemanticSimilarityExampleSelector,
+    sorted_values,
 )
-from langchain.vectorstores import Chroma
+from langchain.vectorstores import FAISS
+from langchain.vectorstores.utils import DistanceStrategy
 
 # loading in environment variables
 load_dotenv()
+# streamlit answers each session on its own thread, so the tokenizer must not spin up its own thread pool on top
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
 
 # configuring our CLI profile name
 boto3.setup_default_session(profile_name=os.getenv('profile_name'))
-# increasing the timeout period when invoking bedrock
-config = botocore.config.Config(connect_timeout=120, read_timeout=120)
+# increasing the timeout period when invoking bedrock, sizing the connection pool so concurrent questions can reuse open
+# HTTPS connections instead of performing a new TLS handshake, and keeping idle connections alive
+config = botocore.config.Config(connect_timeout=120,
+                                read_timeout=120,
+                                max_pool_connections=50,
+                                retries={"max_attempts": 2, "mode": "adaptive"},
+                                tcp_keepalive=True)
 # instantiating the bedrock client
 bedrock = boto3.client('bedrock-runtime', 'us-east-1', endpoint_url='https://bedrock-runtime.us-east-1.amazonaws.com',
                        config=config)
+# configure model specifics such as specific model
+MODEL_ID = 'anthropic.claude-3-haiku-20240307-v1:0'
+ACCEPT = 'application/json'
+CONTENT_TYPE = 'application/json'
+# parameters that are passed into the bedrock invoke model request along with the prompt
+# TODO: TUNE THESE PARAMETERS AS YOU SEE FIT
+MODEL_PARAMETERS = {"anthropic_version": "bedrock-2023-05-31",
+                    "max_tokens": 1024,
+                    "temperature": 0
+                    }
+# the parameters never change, so the request body surrounding the prompt is JSON encoded once, the prompt is sent as
+# the content of a single user message of the Messages API
+_BODY_PREFIX = orjson.dumps(MODEL_PARAMETERS)[:-1] + b',"messages":[{"role":"user","content":'
+_BODY_SUFFIX = b'}]}'
+# This is formatting the prompts that are retrieved from the sample_prompts/generic_samples.yaml file
+_EXAMPLE_PROMPT = PromptTemplate(input_variables=["input", "answer"], template="\n\nHuman: {input} \n\nAssistant: "
+                                                                               "{answer}")
+# This is formatting the chat history and the user input, which follow the retrieved prompts
+_SUFFIX_PROMPT = PromptTemplate(input_variables=["chat_history", "input"],
+                                template="Chat History: {chat_history}\n\nHuman: {input}\n\nAssistant:")
+# the embeddings model used to produce embeddings of user queries and prompts
+EMBEDDING_MODEL_NAME = "BAAI/bge-small-en-v1.5"
+# the number of threads each embeddings call may use, keeping concurrent sessions from oversubscribing the CPU
+EMBEDDING_THREADS = int(os.getenv("embedding_threads", "1"))
+# the directory where the embeddings of the sample prompts are cached between runs
+EMBEDDING_CACHE_DIR = "cache"
+# the cosine similarity above which a previous answer is reused for a new question instead of invoking Amazon Bedrock,
+# bge-small scores related questions in a narrow high band, so this is kept close to 1 and can be tightened further
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("semantic_cache_threshold", "0.99"))
+# the maximum number of previous answers kept for reuse, the oldest answers are evicted first
+SEMANTIC_CACHE_SIZE = 256
 
 
+@functools.lru_cache(maxsize=1)
 def load_samples():
     """
     Load the generic examples for few-shot prompting.
@@ -39,21 +93,262 @@ def load_samples():
     return generic_samples
 
 
+class FastEmbedEmbeddings(Embeddings):
+    """
+    A LangChain embeddings wrapper around the fastembed ONNX Runtime text embedding models, used to produce embeddings
+    of user queries and prompts without loading PyTorch.
+    """
+
+    def __init__(self, model_name, batch_size=64, threads=None):
+        """
+        Load the ONNX embedding model, fastembed downloads the int8 quantized ONNX graph of the model and runs it with an
+        ONNX Runtime CPU session using every graph optimization (ORT_ENABLE_ALL).
+        :param model_name: The name of the fastembed supported model to load.
+        :param batch_size: The number of strings encoded together in a single call to the model.
+        :param threads: The number of threads ONNX Runtime may use per call, defaults to every available core.
+        """
+        # instantiating the fastembed text embedding model
+        self.model = TextEmbedding(model_name=model_name, threads=threads)
+        self.batch_size = batch_size
+        # caching query embeddings per instance, so the cache does not keep every instance alive
+        self._embed_query = functools.lru_cache(maxsize=1024)(self._embed_query_uncached)
+
+    def embed_array(self, texts):
+        """
+        Embed a list of documents into a matrix.
+        :param texts: The list of strings to embed.
+        :return: A float32 matrix of shape (number of strings, embedding dimension) with L2 normalized rows.
+        """
+        # fastembed returns a generator of numpy arrays, stacking them into a single float32 matrix
+        embeddings = np.asarray(list(self.model.embed(texts, batch_size=self.batch_size)), dtype=np.float32)
+        # L2 normalizing each row once at encode time, so the inner product between two embeddings is their cosine
+        # similarity
+        embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings
+
+    def embed_documents(self, texts):
+        """
+        Embed a list of documents.
+        :param texts: The list of strings to embed.
+        :return: A list containing one embedding (a list of floats) for each string.
+        """
+        # converting each normalized embedding into a list of floats
+        return self.embed_array(texts).tolist()
+
+    def embed_query(self, text):
+        """
+        Embed a single query.
+        :param text: The string to embed.
+        :return: The embedding of the string as a list of floats.
+        """
+        # returning a copy of the cached embedding, so callers are free to modify the list
+        return list(self._embed_query(text))
+
+    def _embed_query_uncached(self, text):
+        """
+        Embed a single query, this is wrapped in a per instance cache by __init__ so repeated questions only need to be
+        embedded once.
+        :param text: The string to embed.
+        :return: The embedding of the string as a tuple of floats.
+        """
+        # embedding the query as a single document, stored as a tuple so the cached value cannot be modified
+        return tuple(self.embed_documents([text])[0])
+
+
+@functools.lru_cache(maxsize=1)
+def _get_embeddings():
+    """
+    Instantiate the embeddings model once per process, so the model weights are not reloaded from disk on every question.
+    :return: The cached embeddings model used to produce embeddings of user queries and prompts.
+    """
+    # instantiating the bge-small ONNX embeddings model to be used to produce embeddings of user queries and prompts
+    return FastEmbedEmbeddings(model_name=EMBEDDING_MODEL_NAME, threads=EMBEDDING_THREADS)
+
+
+def samples_hash():
+    """
+    Compute a short content hash of the generic_samples.yaml file and the embeddings model name, used to detect when the
+    cached embeddings of the sample prompts are out of date.
+    :return: The first 16 hex characters of the sha256 digest of the embeddings model name and generic_samples.yaml file.
+    """
+    # hashing the model name, since embeddings produced by a different model cannot be reused
+    digest = hashlib.sha256(EMBEDDING_MODEL_NAME.encode())
+    # reading the raw bytes of the sample prompts file and adding them to the hash
+    with open("sample_prompts/generic_samples.yaml", "rb") as stream:
+        digest.update(stream.read())
+    return digest.hexdigest()[:16]
+
+
+def load_sample_embeddings(texts):
+    """
+    Load the embeddings of the sample prompts from the cache directory, or embed them and write them to the cache if this
+    version of the generic_samples.yaml file has not been embedded before.
+    :param texts: The formatted sample prompts to embed.
+    :return: A float32 matrix of shape (number of prompts, embedding dimension) with L2 normalized rows.
+    """
+    # the cache file is keyed by the content hash, so a new file is written whenever the samples or model change
+    cache_path = os.path.join(EMBEDDING_CACHE_DIR, f"examples_{samples_hash()}.npz")
+    # if the sample prompts have already been embedded, load the cached matrix
+    if os.path.exists(cache_path):
+        try:
+            with np.load(cache_path) as cached:
+                embeddings = cached["embeddings"]
+            # a cached matrix with the wrong number of rows is treated like a missing one
+            if embeddings.shape[0] == len(texts):
+                return embeddings
+        except (OSError, EOFError, ValueError, KeyError, zipfile.BadZipFile):
+            # an unreadable cache file (e.g. truncated by an interrupted write) is a cache miss, it is re-embedded below
+            pass
+    # embedding all the sample prompts into a float32 matrix of shape (number of prompts, embedding dimension), the rows
+    # are L2 normalized so the inner product between a question and a prompt is their cosine similarity
+    embeddings = _get_embeddings().embed_array(texts)
+    # writing the matrix to a temporary file in the cache directory and then moving it into place, so other processes never
+    # see a partially written cache file
+    os.makedirs(EMBEDDING_CACHE_DIR, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=EMBEDDING_CACHE_DIR, suffix=".npz.tmp", delete=False) as temporary:
+        try:
+            np.savez_compressed(temporary, embeddings=embeddings)
+        except BaseException:
+            # removing the incomplete temporary file before passing the error on
+            temporary.close()
+            os.remove(temporary.name)
+            raise
+    os.replace(temporary.name, cache_path)
+    return embeddings
+
+
+@functools.lru_cache(maxsize=1)
+def _get_selector():
+    """
+    Build the semantic similarity example selector once per process. The sample prompts are static, so they only need to
+    be embedded and stored in the vector store a single time, after which each question only needs to be embedded itself.
+    :return: The cached example selector that returns the prompts most similar to a question.
+    """
+    # loading the sample prompts from sample_prompts/generic_samples.yaml
+    examples = load_samples()
+    # formatting each sample prompt as a single string to embed, in the same way from_examples does
+    texts = [" ".join(sorted_values(example)) for example in examples]
+    # loading the embeddings of the sample prompts, they are only computed the first time the samples file is used
+    embeddings = load_sample_embeddings(texts)
+    # storing the embeddings in a brute force FAISS inner product index that quantizes each dimension to 8 bits, which
+    # keeps the search exhaustive while using a quarter of the memory of the float32 matrix
+    index = faiss.IndexScalarQuantizer(embeddings.shape[1], faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+    # training the quantizer learns the range of each dimension, which is then used to encode the embeddings
+    index.train(embeddings)
+    index.add(embeddings)
+    # storing each sample prompt as a document, with the example itself as metadata so the selector can return it
+    docstore = InMemoryDocstore({str(position): Document(page_content=text, metadata=example)
+                                 for position, (text, example) in enumerate(zip(texts, examples))})
+    vectorstore = FAISS(_get_embeddings(),
+                        index,
+                        docstore,
+                        {position: str(position) for position in range(len(texts))},
+                        distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT)
+    # a semantic search is performed to see the similarity between the question and prompts, it returns the 3 most
+    # similar prompts as defined by k
+    # TODO: Can change this number to determine how many prompts you want to retrieve
+    return SemanticSimilarityExampleSelector(vectorstore=vectorstore, k=3)
+
+
+# caching the contents of the chat_history.txt file, along with the modification time and size they were read at
+_chat_cache = {"mtime": None, "size": None, "data": None}
+
+
 def chat_history_loader():
     """
-    This function reads the chat_history.txt file, and puts it into a string to later inject into our prompt.
+    This function reads the chat_history.txt file, and puts it into a string to later inject into our prompt. The file is
+    only read again when its modification time or size has changed since it was last read.
     :return: A string containing all the chat history question and answers in a prompt format.
     """
     # opening the chat history txt file
-    with open("chat_history.txt", "r") as file:
-        # reading the contents of the chat_history.txt file and reading it into a string
-        chat_history = file.read()
-        # simple logic if there is no Chat History return None
-        if chat_history == "":
+    with open("chat_history.txt", "rb") as file:
+        # checking the modification time and size of the file that was opened, rather than of the path, so they describe
+        # the same file that is read below
+        stat = os.fstat(file.fileno())
+        # if the file has not changed since it was last read, return the cached chat history
+        if stat.st_mtime_ns == _chat_cache["mtime"] and stat.st_size == _chat_cache["size"]:
+            return _chat_cache["data"]
+        # simple logic if there is no Chat History return None, an empty file cannot be memory mapped
+        chat_history = None
+        if stat.st_size:
+            try:
+                # memory mapping the contents of the chat_history.txt file and decoding it into a string
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as contents:
+                    chat_history = contents[:].decode()
+            except ValueError:
+                # another session emptied the file while it was being rewritten, so there is no Chat History to read
+                # yet, and nothing is cached since the file is about to change again
+                return None
+    # storing the chat history under the modification time and size it was read at, so it can be reused until the file
+    # changes
+    _chat_cache.update(mtime=stat.st_mtime_ns, size=stat.st_size, data=chat_history)
+    # if there is Chat History, return it so it can be formatted in the final prompt
+    return chat_history
+
+
+# caching previous answers by the embedding of their question, the index is created once the embedding dimension is known
+# and maps each embedding to an id, the answers are stored by id in the order they were added so the oldest can be evicted
+_answer_cache = {"index": None, "answers": OrderedDict(), "next_id": 0, "lock": threading.Lock()}
+
+
+def semantic_cache_lookup(question, query_embedding, chat_history):
+    """
+    This function searches the previously answered questions for one that is semantically equivalent to the new question,
+    so its answer can be reused instead of invoking Amazon Bedrock again. An identical question always matches, a similar
+    question only matches if it also contains the same numbers (e.g. dates, amounts or counts).
+    :param question: The new question, as typed by the user.
+    :param query_embedding: The L2 normalized embedding of the new question, as a float32 matrix of shape (1, dimension).
+    :param chat_history: The chat history the new question is asked with, answers are only reused with the same history.
+    :return: The cached answer if a previous question is similar enough, otherwise None.
+    """
+    with _answer_cache["lock"]:
+        # there is nothing to search before the first question has been answered
+        index = _answer_cache["index"]
+        if index is None or not index.ntotal:
             return None
-        # if there is Chat History, return it so it can be formatted in the final prompt
-        else:
-            return chat_history
+        # searching the few most similar previous questions, since the closest one may have been asked with another history
+        scores, answer_ids = index.search(query_embedding, min(4, index.ntotal))
+        for score, answer_id in zip(scores[0], answer_ids[0]):
+            if answer_id < 0:
+                break
+            answer, answer_question, answer_chat_history = _answer_cache["answers"][answer_id]
+            # answers are only reused with the same chat history, since follow up questions depend on it
+            if answer_chat_history != chat_history:
+                continue
+            # the embeddings are normalized, so the inner product score is the cosine similarity, questions that only
+            # differ in a number embed almost identically, so their numbers must match as well
+            if answer_question == question or (score >= SEMANTIC_CACHE_THRESHOLD
+                                               and re.findall(r"\d+", answer_question) == re.findall(r"\d+", question)):
+                return answer
+    return None
+
+
+def semantic_cache_record(answer_stream, question, query_embedding, chat_history):
+    """
+    This function passes through a streamed answer and, once it has been fully generated, adds it to the semantic cache.
+    :param answer_stream: The generator streaming the answer from Amazon Bedrock.
+    :param question: The question, as typed by the user.
+    :param query_embedding: The L2 normalized embedding of the question, as a float32 matrix of shape (1, dimension).
+    :param chat_history: The chat history the question was asked with.
+    :return: A generator yielding the same pieces of the answer as answer_stream.
+    """
+    # yielding each piece of the answer as it arrives while keeping them to build the full answer
+    pieces = []
+    for piece in answer_stream:
+        pieces.append(piece)
+        yield piece
+    # the answer is only cached once the stream has completed, so partial answers are never reused
+    with _answer_cache["lock"]:
+        if _answer_cache["index"] is None:
+            _answer_cache["index"] = faiss.IndexIDMap(faiss.IndexFlatIP(query_embedding.shape[1]))
+        answer_id = _answer_cache["next_id"]
+        _answer_cache["next_id"] += 1
+        _answer_cache["index"].add_with_ids(query_embedding, np.array([answer_id], dtype=np.int64))
+        _answer_cache["answers"][answer_id] = ("".join(pieces), question, chat_history)
+        # evicting the oldest answers once the cache is full, so memory stays bounded in a long running server
+        while len(_answer_cache["answers"]) > SEMANTIC_CACHE_SIZE:
+            oldest_id, _ = _answer_cache["answers"].popitem(last=False)
+            _answer_cache["index"].remove_ids(np.array([oldest_id], dtype=np.int64))
 
 
 def prompt_finder(question):
@@ -62,121 +357,126 @@ def prompt_finder(question):
     sample_prompts/generic_samples.yaml file. It finds the three most relevant prompts and formats them into a single prompt
     along with the users question.
     :param question: This is the question that is passed in through the streamlit frontend from the user.
-    :return: This function returns a final prompt that contains three semantically similar prompts, the chat history if
-    there is any and the users question all formatted in a single prompt ready to be passed into Amazon Bedrock. We also return
-    a formatted string containing all of the prompts used for that particular question.
+    :return: This function builds a final prompt that contains three semantically similar prompts, the chat history if
+    there is any and the users question all formatted in a single prompt, passes it into Amazon Bedrock and returns a
+    generator streaming the answer as it is generated. We also return a formatted string containing all of the prompts used
+    for that particular question.
     """
-    # loading the sample prompts from sample_prompts/generic_samples.yaml
-    examples = load_samples()
-    # instantiating the hugging face embeddings model to be used to produce embeddings of user queries and prompts
-    local_embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-    # The example selector loads the examples, creates the embeddings, stores them in Chroma (vector store) and a
-    # semantic search is performed to see the similarity between the question and prompts, it returns the 3 most similar
-    # prompts as defined by k
-    example_selector = SemanticSimilarityExampleSelector.from_examples(
-        # This is the list of examples available to select from.
-        examples,
-        # This is the embedding class used to produce embeddings which are used to measure semantic similarity.
-        local_embeddings,
-        # This is the VectorStore class that is used to store the embeddings and do a similarity search over.
-        Chroma,
-        # This is the number of examples to produce.
-        # TODO: Can change this number to determine how many prompts you want to retrieve
-        k=3
-    )
-    # This is formatting the prompts that are retrieved from the sample_prompts/generic_samples.yaml file
-    example_prompt = PromptTemplate(input_variables=["input", "answer"], template="\n\nHuman: {input} \n\nAssistant: "
-                                                                                  "{answer}")
-    # This is orchestrating the example selector (finding similar prompts to the question), example_prompt (formatting
-    # the retrieved prompts, and formatting the chat history and the user input
-    prompt = FewShotPromptTemplate(
-        example_selector=example_selector,
-        example_prompt=example_prompt,
-        suffix=f"Chat History: {chat_history_loader()}\n\n" + "Human: {input}\n\nAssistant:",
-        input_variables=["input"]
-    )
-    # This is calling the prompt method and passing in the users question to create the final multi-shot prompt,
-    # with the semantically similar prompts, and chat history
-    question_with_prompt = prompt.format(input=question)
-    # storing the generated prompt
-    text = question_with_prompt
-    # parsing out the selected prompts, specifically parsing everything before Chat History
-    head, sep, tail = text.partition("Chat History:")
-    # splitting up the used prompts into an array to better format them
-    used_prompts = head.split("\n\n")
-    # looping through the array and removing any values that are blank spaces from when we performed a split
-    for index, i in enumerate(used_prompts):
-        # if the value is an empty string, we choose to remove it
-        if i == "":
-            # removing the blank value from the list
-            used_prompts.remove(i)
-    # formatting the prompts and storing them as variables, each contains the Question and Answer used for the prompt
-    prompt_one = f"""
-    
-    {used_prompts[0]}
-    
-    {used_prompts[1]}
-    """
-    prompt_two = f"""
-    
-    {used_prompts[2]}
-    
-    {used_prompts[3]}
-    """
-    prompt_three = f"""
-    
-    {used_prompts[4]}
-    
-    {used_prompts[5]}
-    """
-    # formatting all the selected prompts as a single string for easier formatting
-    selected_prompts = f"""
-    Prompt 1:
-    
-    {prompt_one}
-    
-    Prompt 2: 
-    
-    {prompt_two}
-     
-    Prompt 3:
-    
-    {prompt_three}
-    """
-    # we return the finalized prompt, ready to be passed into Amazon Bedrock to generate a response, along with a string containing
+    # retrieving the cached example selector, which holds the embedded sample prompts from
+    # sample_prompts/generic_samples.yaml
+    example_selector = _get_selector()
+    # performing the semantic search between the question and prompts once, returning the most similar prompts
+    selected = example_selector.select_examples({"input": question})
+    # loading the chat history once, it is used both in the final prompt and to look up previous answers
+    chat_history = chat_history_loader() or ""
+    # This is formatting the selected prompts (each formatted by _EXAMPLE_PROMPT), the chat history and the user input
+    # into the final multi-shot prompt, separating each part by a blank line in the same way FewShotPromptTemplate does
+    question_with_prompt = "\n\n".join(
+        [_EXAMPLE_PROMPT.format(input=example["input"], answer=example["answer"]) for example in selected]
+        + [_SUFFIX_PROMPT.format(chat_history=chat_history, input=question)])
+    # formatting all the selected prompts as a single string for easier formatting, each contains the Question and
+    # Answer used for the prompt
+    selected_prompts = "\n".join(f"Prompt {position + 1}:\n\n"
+                                 f"Human: {example['input']}\n\n"
+                                 f"Assistant: {example['answer']}\n"
+                                 for position, example in enumerate(selected))
+    # reusing the embedding of the question computed by the example selector, which is cached by the embeddings model
+    query_embedding = np.asarray([_get_embeddings().embed_query(question)], dtype=np.float32)
+    # if a semantically equivalent question has already been answered, we return its answer without invoking Amazon
+    # Bedrock, along with a string containing the dynamically selected prompts
+    cached_answer = semantic_cache_lookup(question, query_embedding, chat_history)
+    if cached_answer is not None:
+        return iter([cached_answer]), selected_prompts
+    # we pass the finalized prompt into Amazon Bedrock and return the streamed response, along with a string containing
     # the dynamically selected prompts
-    return llm_answer_generator(question_with_prompt), selected_prompts
+    return (semantic_cache_record(llm_answer_stream(question_with_prompt), question, query_embedding, chat_history),
+            selected_prompts)
 
 
+def bedrock_request_body(question_with_prompt):
+    """
+    This function builds the body of the request that is passed into Amazon Bedrock. Only the prompt changes between
+    requests, so it is JSON encoded on its own and joined with the pre-encoded model parameters.
+    :param question_with_prompt: This is the finalized prompt that includes semantically similar prompts, chat history,
+    and the users question all in a proper multi-shot format.
+    :return: The JSON encoded request body, as bytes.
+    """
+    # joining the encoded prompt with the rest of the body that was encoded when the module was loaded
+    return _BODY_PREFIX + orjson.dumps(question_with_prompt) + _BODY_SUFFIX
+
+
+@functools.lru_cache(maxsize=256)
 def llm_answer_generator(question_with_prompt):
     """
     This function is used to invoke Amazon Bedrock using the finalized prompt that was created by the prompt_finder(question)
     function.
     :param question_with_prompt: This is the finalized prompt that includes semantically similar prompts, chat history,
     and the users question all in a proper multi-shot format.
-    :return: The final answer to the users question.
+    :return: The final answer to the users question. Answers are cached, so asking an identical prompt again does not
+    invoke Amazon Bedrock. This exact cache only applies to this non-streaming function and the async helpers built on it,
+    the streamlit frontend goes through llm_answer_stream(question_with_prompt) and the semantic answer cache instead.
     """
-    # body of data with parameters that is passed into the bedrock invoke model request
-    # TODO: TUNE THESE PARAMETERS AS YOU SEE FIT
-    body = json.dumps({"prompt": question_with_prompt,
-                       "max_tokens_to_sample": 8191,
-                       "temperature": 0,
-                       "top_k": 250,
-                       "top_p": 0.5,
-                       "stop_sequences": []
-                       })
-    # configure model specifics such as specific model
-    modelId = 'anthropic.claude-v2'
-    accept = 'application/json'
-    contentType = 'application/json'
     # Invoking the bedrock model with your specifications
-    response = bedrock.invoke_model(body=body,
-                                    modelId=modelId,
-                                    accept=accept,
-                                    contentType=contentType)
+    response = bedrock.invoke_model(body=bedrock_request_body(question_with_prompt),
+                                    modelId=MODEL_ID,
+                                    accept=ACCEPT,
+                                    contentType=CONTENT_TYPE)
     # the body of the response that was generated
-    response_body = json.loads(response.get('body').read())
-    # retrieving the specific completion field, where you answer will be
-    answer = response_body.get('completion')
+    response_body = orjson.loads(response.get('body').read())
+    # retrieving the text of the first content block, where you answer will be
+    answer = response_body.get('content')[0].get('text')
     # returning the answer as a final result, which ultimately gets returned to the end user
     return answer
+
+
+def llm_answer_stream(question_with_prompt):
+    """
+    This function is the streaming version of llm_answer_generator(question_with_prompt). It yields the answer as it is
+    generated by Amazon Bedrock, so the frontend can start displaying it as soon as the first tokens arrive.
+    :param question_with_prompt: This is the finalized prompt that includes semantically similar prompts, chat history,
+    and the users question all in a proper multi-shot format.
+    :return: A generator yielding the pieces of the final answer to the users question, in order. The answer is not
+    cached here, prompt_finder(question) checks the semantic answer cache (which also covers repeated identical questions)
+    before calling this function.
+    """
+    # Invoking the bedrock model with your specifications, returning the response as a stream of events
+    response = bedrock.invoke_model_with_response_stream(body=bedrock_request_body(question_with_prompt),
+                                                         modelId=MODEL_ID,
+                                                         accept=ACCEPT,
+                                                         contentType=CONTENT_TYPE)
+    # looping through each event of the response stream as it is received
+    for event in response.get('body'):
+        # only chunk events contain a part of the generated answer
+        chunk = event.get('chunk')
+        if chunk:
+            message_event = orjson.loads(chunk.get('bytes'))
+            # only content block deltas carry generated text, the other message events describe the message itself
+            if message_event.get('type') == 'content_block_delta':
+                # retrieving the text of the delta, where the next part of your answer will be
+                yield message_event.get('delta').get('text', '')
+
+
+async def llm_answer_generator_async(question_with_prompt):
+    """
+    This function is the asynchronous version of llm_answer_generator(question_with_prompt). The blocking boto3 call is
+    run in the default thread pool executor, so the event loop is free to overlap the network I/O of several questions.
+    :param question_with_prompt: This is the finalized prompt that includes semantically similar prompts, chat history,
+    and the users question all in a proper multi-shot format.
+    :return: The final answer to the users question.
+    """
+    # retrieving the event loop that is currently running this coroutine
+    loop = asyncio.get_running_loop()
+    # invoking Amazon Bedrock in a worker thread and waiting for the answer without blocking the event loop
+    return await loop.run_in_executor(None, llm_answer_generator, question_with_prompt)
+
+
+async def llm_answers_generator_async(questions_with_prompts):
+    """
+    This function invokes Amazon Bedrock concurrently for several finalized prompts.
+    :param questions_with_prompts: A list of finalized prompts, each including semantically similar prompts, chat history,
+    and a users question all in a proper multi-shot format.
+    :return: A list containing the final answer to each prompt, in the same order as the prompts that were passed in.
+    """
+    # fanning out one Amazon Bedrock invocation per prompt and waiting for all of them to complete
+    return await asyncio.gather(*[llm_answer_generator_async(question_with_prompt)
+                                  for question_with_prompt in questions_with_prompts])